@@ -3,98 +3,162 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 import sqlite3
 import os
 import secrets
-from werkzeug.security import generate_password_hash, check_password_hash
+from jinja2 import FileSystemBytecodeCache
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from decorators import login_required
-# stok.py'den init_stock_table'ı ve blueprint'i içe aktar
-from stok import stok_bp, init_stock_table 
+from passwords import hash_password, verify_password, verify_dummy_password, needs_rehash
+from db_pool import get_pool, get_writer, close_all
+# stok.py'den blueprint'i ve stok veritabanı klasörünü içe aktar
+from stok import stok_bp, STOCK_DB_DIR
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16) # Güvenli bir secret key oluştur
+
+# Derlenmiş şablonlar diskte saklanır; yeni açılan süreçler şablonları yeniden derlemez.
+# Dizin verilmediğinde Jinja kullanıcıya özel, 0700 izinli bir dizin kullanır ve sahipliğini doğrular;
+# böylece başka bir yerel kullanıcı önbelleğe derlenmiş şablon koyamaz.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+# Sunucu tarafı session: REDIS_URL tanımlıysa session verisi Redis'te tutulur,
+# çerezde yalnızca session id taşınır. Tanımlı değilse Flask'ın imzalı çerez session'ı kullanılır.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    import redis
+    from flask_session import Session
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(REDIS_URL)
+    Session(app)
+
+# Şifre hash'leme bilerek yavaş olduğundan giriş/kayıt denemeleri IP başına sınırlanır.
+# REDIS_URL varsa sayaçlar tüm worker'lar arasında Redis'te paylaşılır.
+limiter = Limiter(get_remote_address, app=app, storage_uri=REDIS_URL or 'memory://')
+AUTH_RATE_LIMIT = '5/minute'
 
 # Veritabanı yolları
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 USERS_DB_PATH = os.path.join(BASE_DIR, 'users.db')
-# Her kullanıcı için dinamik stok veritabanlarını tutacak klasör
-STOCK_DB_DIR = os.path.join(BASE_DIR, 'stock_dbs') 
+SECRET_KEY_PATH = os.path.join(BASE_DIR, '.secret_key')
+
+def load_secret_key():
+    """
+    Session imzalama anahtarını döndürür: önce SECRET_KEY ortam değişkeni, yoksa .secret_key dosyası.
+    Dosya yoksa ilk açılışta bir kez oluşturulur; böylece yeniden başlatmalarda ve birden fazla
+    worker arasında aynı anahtar kullanılır ve kullanıcıların oturumları düşmez.
+    """
+    env_key = os.environ.get('SECRET_KEY')
+    if env_key:
+        return env_key
+    if not os.path.exists(SECRET_KEY_PATH):
+        # Önce geçici dosyaya yaz, sonra link ile atomik olarak yerleştir;
+        # aynı anda açılan worker'lardan yalnızca biri anahtarı oluşturur.
+        # Dosya yalnızca sahibinin okuyabileceği izinlerle (0600) oluşturulur.
+        tmp_path = f'{SECRET_KEY_PATH}.{os.getpid()}'
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            f.write(secrets.token_bytes(32))
+        try:
+            os.link(tmp_path, SECRET_KEY_PATH)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_PATH, 'rb') as f:
+        return f.read()
+
+app.secret_key = load_secret_key()
+
+# stock_dbs dizininin var olduğundan emin olun (birden fazla worker aynı anda başlasa da güvenli)
+os.makedirs(STOCK_DB_DIR, exist_ok=True)
 
-# stock_dbs dizininin var olduğundan emin olun
-if not os.path.exists(STOCK_DB_DIR):
-    os.makedirs(STOCK_DB_DIR)
+# users.db sorguları sütunları açıkça seçip sırayla okur; sqlite3.Row'a gerek yoktur
+def get_users_read_pool():
+    return get_pool(USERS_DB_PATH, readonly=True, row_factory=None)
 
 # SQLite bağlantısı
 def get_db():
-    """Genel kullanıcı veritabanı (users.db) bağlantısını döndürür."""
+    """
+    Genel kullanıcı veritabanı (users.db) için salt okunur bir bağlantıyı
+    havuzdan alır ve istek boyunca döndürür. Yazmalar için get_user_db_writer() kullanılır.
+    """
     if not hasattr(g, 'user_db'):
-        g.user_db = sqlite3.connect(USERS_DB_PATH)
-        g.user_db.row_factory = sqlite3.Row
+        g.user_db = get_users_read_pool().acquire()
     return g.user_db
 
-# Uygulama kapatıldığında veritabanı bağlantısını kapat
+def get_user_db_writer():
+    """
+    users.db'nin tek yazıcı bağlantısıyla bir işlem başlatır.
+    `with get_user_db_writer() as db:` bloğu kilit altında çalışır ve sonunda commit edilir.
+    """
+    return get_writer(USERS_DB_PATH, row_factory=None).transaction()
+
+# Uygulama kapatıldığında veritabanı bağlantısını havuza geri ver
 @app.teardown_appcontext
 def close_db(error):
-    """Uygulama bağlamı sona erdiğinde kullanıcı veritabanı bağlantısını kapatır."""
+    """Uygulama bağlamı sona erdiğinde kullanıcı veritabanı bağlantısını havuza iade eder."""
     if hasattr(g, 'user_db'):
-        g.user_db.close()
+        get_users_read_pool().release(g.user_db)
+
+# users.db şema sürümü; şema değiştiğinde artırılır ve init_user_db()'ye geçiş adımı eklenir
+USERS_SCHEMA_VERSION = 1
 
 # Kullanıcılar veritabanını başlat (users.db)
 def init_user_db():
     """
-    Users veritabanını ve 'users' tablosunu oluşturur/günceller.
-    'stock_db_path' sütununu ekler.
+    Users veritabanını ve 'users' tablosunu oluşturur.
+    Şema sürümü PRAGMA user_version'da tutulur; veritabanı güncelse tek bir pragma okunup çıkılır.
+    Stok veritabanı yolu kullanıcı ID'sinden türetildiği için (stock_db_path_for) tabloda tutulmaz.
+    Eski veritabanlarındaki 'stock_db_path' sütunu UNIQUE olduğundan SQLite'ta silinemez; kullanılmadan kalır.
     """
-    with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
+    with get_user_db_writer() as db:
+        if db.execute("PRAGMA user_version").fetchone()[0] >= USERS_SCHEMA_VERSION:
+            return
+
+        db.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                stock_db_path TEXT UNIQUE -- Kullanıcıya özel stok veritabanı yolu
+                password TEXT NOT NULL
             )
         ''')
-        # Mevcut 'users' tablosuna 'stock_db_path' sütununu eklemek için kontrol
-        cursor.execute("PRAGMA table_info(users)")
-        user_table_columns = [row[1] for row in cursor.fetchall()]
-        if 'stock_db_path' not in user_table_columns:
-            cursor.execute('ALTER TABLE users ADD COLUMN stock_db_path TEXT UNIQUE')
-        
-        db.commit()
+        db.execute(f"PRAGMA user_version = {USERS_SCHEMA_VERSION}")
         print("Users veritabanı oluşturuldu/güncellendi.")
 
 # Blueprint'i kaydet
 app.register_blueprint(stok_bp)
 
+# Tarayıcının kısa süre önbelleğe alabileceği, veri içermeyen sayfalar
+CACHEABLE_ENDPOINTS = frozenset({'home', 'login', 'register'})
+
+@app.after_request
+def add_cache_headers(response):
+    """
+    Statik sayılabilecek sayfaların GET yanıtlarına kısa süreli Cache-Control ekler.
+    Flash mesajı gösterilen (session'ı değiştiren) yanıtlar önbelleğe alınmaz;
+    giriş durumu değişince session çerezi de değiştiği için 'Vary: Cookie' eklenir.
+    """
+    if (request.method == 'GET' and response.status_code == 200
+            and request.endpoint in CACHEABLE_ENDPOINTS and not session.modified):
+        response.headers['Cache-Control'] = 'private, max-age=60'
+        response.vary.add('Cookie')
+    return response
+
 @app.route('/')
 def home():
     return render_template('home.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@limiter.limit(AUTH_RATE_LIMIT, methods=['POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-
-        db = get_db() # users.db bağlantısı
-        cursor = db.cursor()
+        hashed_password = hash_password(password)
 
         try:
-            # Kullanıcıyı ekle (stock_db_path başlangıçta NULL olabilir)
-            cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-            user_id = cursor.lastrowid # Yeni kullanıcının ID'sini al
-
-            # Kullanıcıya özel stok veritabanı yolunu oluştur
-            user_stock_db_name = f'stock_{user_id}.db'
-            user_stock_db_path = os.path.join(STOCK_DB_DIR, user_stock_db_name)
-
-            # users tablosundaki 'stock_db_path' sütununu güncelle
-            cursor.execute("UPDATE users SET stock_db_path = ? WHERE id = ?", (user_stock_db_path, user_id))
-            db.commit()
-
-            # Kullanıcıya özel stok veritabanı dosyasını ve tablolarını başlat
-            # Bu çağrı, stok modülündeki init_stock_table fonksiyonunu kullanır.
-            init_stock_table(user_stock_db_path, user_id) 
+            # Kullanıcıya özel stok veritabanı burada oluşturulmaz; kayıt isteği yalnızca
+            # şifre hash'i ve tek INSERT kadar sürer. Veritabanı ilk stok erişiminde
+            # stok.get_stock_db() tarafından oluşturulur.
+            with get_user_db_writer() as db:
+                db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
 
             flash("Hesabınız başarıyla oluşturuldu!", "success")
             return redirect(url_for('login'))
@@ -106,20 +170,31 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit(AUTH_RATE_LIMIT, methods=['POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        db = get_db() # users.db bağlantısı
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
+        db = get_db() # users.db okuyucu bağlantısı
+        # username UNIQUE olduğundan sorgu sqlite_autoindex_users_1 indeksini kullanır;
+        # sadece gereken sütunlar okunur.
+        user = db.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
 
-        if user and check_password_hash(user['password'], password):
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['stock_db_path'] = user['stock_db_path'] # Kullanıcının stok db yolunu session'a kaydet
+        if user is None:
+            # Kullanıcı yoksa da hash doğrulaması kadar süre harca
+            is_valid = verify_dummy_password(password)
+        else:
+            user_id, stored_hash = user
+            is_valid = verify_password(stored_hash, password)
+
+        if is_valid:
+            # Eski PBKDF2 hash'lerini başarılı girişte Argon2id'ye taşı
+            if needs_rehash(stored_hash):
+                with get_user_db_writer() as writer_db:
+                    writer_db.execute("UPDATE users SET password = ? WHERE id = ?", (hash_password(password), user_id))
+            session['user_id'] = user_id
+            session['username'] = username
             flash("Giriş başarılı!", "success")
             return redirect(url_for('dashboard'))
         else:
@@ -135,12 +210,19 @@ def dashboard():
 def logout():
     session.pop('user_id', None)
     session.pop('username', None)
-    session.pop('stock_db_path', None) # Session'dan da kaldır
     flash("Başarıyla çıkış yaptınız.", "info")
     return redirect(url_for('home'))
 
-if __name__ == '__main__':
-    # init_user_db() uygulamanın başlatılmasında bir kez çağrılmalı.
-    init_user_db() 
-    app.run(debug=True)
+def create_app():
+    """
+    Uygulamayı çalışmaya hazırlar ve Flask nesnesini döndürür.
+    gunicorn (preload_app) bunu master süreçte bir kez çağırır; users.db şeması worker'lar
+    başlamadan hazırlanır ve açılan bağlantılar fork öncesi kapatılır.
+    """
+    init_user_db()
+    close_all()
+    return app
 
+if __name__ == '__main__':
+    # Geliştirme sunucusu; üretimde gunicorn -c gunicorn_conf.py "app:create_app()" kullanılır.
+    create_app().run(debug=os.environ.get('FLASK_DEBUG') == '1')
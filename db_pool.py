@@ -0,0 +1,224 @@
+# db_pool.py
+import sqlite3
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+# Her bağlantı açılışında uygulanan SQLite ayarları.
+# journal_mode kalıcıdır (dosyaya yazılır), diğerleri bağlantı başınadır.
+SQLITE_PRAGMAS = '''
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-8000;
+'''
+
+# Salt okunur bağlantılar journal_mode'u değiştiremez; sadece bağlantı başına ayarlar.
+SQLITE_READ_PRAGMAS = '''
+    PRAGMA busy_timeout=5000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-8000;
+'''
+
+# Bağlantı başına hazırlanmış (prepared) ifade önbelleği; sqlite3 varsayılanı 128'dir.
+# Dinamik sütunlu sorgular da aynı metinle tekrarlandığından daha geniş önbellek yeniden derlemeyi önler.
+CACHED_STATEMENTS = 256
+
+
+class SqlitePool:
+    """
+    Tek bir SQLite dosyası için thread-safe bağlantı havuzu.
+    Bağlantılar istekler arasında yeniden kullanılır; böylece her istekte bağlantı açma
+    maliyeti ödenmez ve SQLite'ın sayfa önbelleği sıcak kalır.
+    Bağlantılar ihtiyaç oldukça açılır, en fazla `size` tanesi boşta tutulur.
+    `readonly=True` ile bağlantılar `mode=ro` URI'si ile salt okunur açılır.
+    `row_factory=None` verilirse satırlar sqlite3.Row yerine düz tuple olarak döner.
+    """
+
+    def __init__(self, path, size=8, pragmas=None, readonly=False, row_factory=sqlite3.Row):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.row_factory = row_factory
+        if pragmas is None:
+            pragmas = SQLITE_READ_PRAGMAS if readonly else SQLITE_PRAGMAS
+        self.pragmas = pragmas
+        # LIFO: en son iade edilen (önbelleği en sıcak) bağlantı ilk verilir
+        self._idle = queue.LifoQueue(maxsize=size)
+        # close() sonrası iade edilen bağlantılar havuza konmaz, kapatılır
+        self._closed = False
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{pathname2url(self.path)}?mode=ro', uri=True, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = self.row_factory
+        conn.executescript(self.pragmas)
+        return conn
+
+    def acquire(self):
+        """
+        Havuzdan boşta bir bağlantı alır, yoksa yenisini açar.
+        Havuzdan gelen bağlantı kullanılamaz durumdaysa kapatılır ve yerine yenisi açılır.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._is_healthy(conn):
+                return conn
+            conn.close()
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def release(self, conn):
+        """
+        Bağlantıyı havuza geri koyar; havuz doluysa bağlantıyı kapatır.
+        Yarım kalmış bir işlem varsa geri alınır, böylece kilit bir sonraki isteğe taşınmaz.
+        Geri alma başarısız olursa bağlantı havuza konmaz.
+        """
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        """Boşta bekleyen tüm bağlantıları kapatır."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def close(self):
+        """
+        Havuzu kapatır: boştaki bağlantılar hemen, o an kullanımda olanlar iade edildiğinde kapatılır.
+        Kayıt defterinden çıkarılan (LRU) havuzlar için kullanılır.
+        """
+        self._closed = True
+        self.close_all()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+class SqliteWriter:
+    """
+    Bir SQLite dosyası için tek yazıcı bağlantısı.
+    SQLite aynı anda tek yazıcıya izin verdiğinden yazmalar uygulama içinde bir kilitle sıralanır;
+    böylece eşzamanlı kayıtlarda SQLITE_BUSY beklemesi yaşanmaz.
+    """
+
+    def __init__(self, path, pragmas=SQLITE_PRAGMAS, row_factory=sqlite3.Row):
+        self.path = path
+        self.pragmas = pragmas
+        self.row_factory = row_factory
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = self.row_factory
+        conn.executescript(self.pragmas)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yazıcı kilidini alır ve bağlantıyı tek bir işlem olarak kullandırır.
+        Blok başarıyla biterse commit, hata olursa rollback yapılır.
+        """
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                yield self._conn
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# (veritabanı yolu, salt okunur mu) -> havuz ve veritabanı yolu -> yazıcı.
+# İlk oluşturma kilitle korunur.
+# Kullanıcı başına stok veritabanları nedeniyle havuz sayısı kullanıcı sayısıyla büyür; kayıt defteri
+# en son kullanılan MAX_POOLS havuzla sınırlıdır (LRU). Çıkarılan havuz kapatılır, dosya tanıtıcıları
+# ve sayfa önbellekleri serbest kalır; gerekirse bir sonraki erişimde yeniden oluşturulur.
+MAX_POOLS = 64
+_pools = OrderedDict()
+_writers = {}
+_registry_lock = threading.Lock()
+
+
+def get_pool(path, size=8, readonly=False, row_factory=sqlite3.Row, pragmas=None):
+    """
+    Verilen veritabanı yolu için süreç genelindeki havuzu döndürür, yoksa oluşturur.
+    `size`, `row_factory` ve `pragmas` yalnızca havuz ilk oluşturulurken kullanılır.
+    """
+    key = (path, readonly)
+    with _registry_lock:
+        pool = _pools.get(key)
+        if pool is not None:
+            _pools.move_to_end(key)
+            return pool
+        pool = _pools[key] = SqlitePool(path, size, pragmas=pragmas, readonly=readonly, row_factory=row_factory)
+        while len(_pools) > MAX_POOLS:
+            _pools.popitem(last=False)[1].close()
+    return pool
+
+
+def get_writer(path, row_factory=sqlite3.Row):
+    """Verilen veritabanı yolu için süreç genelindeki tek yazıcıyı döndürür, yoksa oluşturur."""
+    writer = _writers.get(path)
+    if writer is None:
+        with _registry_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                writer = _writers[path] = SqliteWriter(path, row_factory=row_factory)
+    return writer
+
+
+def close_all():
+    """
+    Süreçteki tüm havuz ve yazıcı bağlantılarını kapatır.
+    SQLite bağlantıları fork ile alt süreçlere taşınmamalıdır; preload edilen
+    uygulamada worker'lar başlamadan önce master süreçte çağrılır.
+    """
+    with _registry_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        for writer in _writers.values():
+            writer.close()
+        _pools.clear()
+        _writers.clear()
@@ -0,0 +1,14 @@
+# gunicorn_conf.py
+# Kullanım: gunicorn -c gunicorn_conf.py "app:create_app()"
+import multiprocessing
+
+bind = '0.0.0.0:8000'
+
+# Şifre hash'leme CPU yoğun olduğundan her çekirdeğe worker düşer;
+# gthread ile her worker birkaç isteği paralel karşılar.
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gthread'
+threads = 2
+
+# create_app() (users.db şema kontrolü) master süreçte bir kez çalışır, worker'lar fork ile devralır.
+preload_app = True
@@ -0,0 +1,97 @@
+# passwords.py
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from werkzeug.security import check_password_hash
+
+# Argon2id parametreleri: sunucuda tek doğrulama ~100-200 ms sürecek şekilde ayarlanmıştır.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+ARGON2_PREFIX = '$argon2'
+
+# Kullanıcı bulunamadığında da gerçek bir doğrulama kadar süre harcamak için kullanılan sabit hash
+_DUMMY_HASH = password_hasher.hash(secrets.token_hex(16))
+
+# Toplu doğrulamalar için thread havuzu. argon2-cffi ve OpenSSL hash hesaplaması sırasında
+# GIL'i bıraktığından doğrulamalar farklı çekirdeklerde paralel çalışır.
+# Thread'ler ilk kullanımda açılır.
+HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Başarılı şifre doğrulamalarının süreç içi önbelleği.
+# Anahtar düz şifre değil, süreç başına üretilen gizli anahtarla alınmış HMAC'tir;
+# süreç yeniden başladığında önbellek de anahtar da sıfırlanır.
+VERIFY_CACHE_SIZE = 4096
+_verify_cache_secret = secrets.token_bytes(32)
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+
+def _verify_cache_key(stored_hash, password):
+    digest = hmac.new(_verify_cache_secret, password.encode('utf-8'), hashlib.sha256).digest()
+    return (stored_hash, digest)
+
+
+def hash_password(password):
+    """Şifreyi Argon2id ile hash'ler; sonuç '$argon2id$...' biçiminde saklanır."""
+    return password_hasher.hash(password)
+
+
+def _check_password(stored_hash, password):
+    """Argon2 hash'lerini argon2-cffi ile, eski 'pbkdf2:' hash'lerini werkzeug ile doğrular."""
+    if not stored_hash.startswith(ARGON2_PREFIX):
+        return check_password_hash(stored_hash, password)
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def verify_dummy_password(password):
+    """
+    Var olmayan kullanıcı için sabit bir hash'e karşı doğrulama yapar ve her zaman False döner.
+    Böylece "kullanıcı yok" ile "şifre yanlış" yanıtları aynı sürede döner (zamanlama sızıntısı olmaz).
+    """
+    _check_password(_DUMMY_HASH, password)
+    return False
+
+
+def needs_rehash(stored_hash):
+    """Hash eski (werkzeug PBKDF2) biçimdeyse veya Argon2 parametreleri değiştiyse True döner."""
+    if not stored_hash.startswith(ARGON2_PREFIX):
+        return True
+    return password_hasher.check_needs_rehash(stored_hash)
+
+
+def verify_password(stored_hash, password):
+    """
+    Şifreyi saklanan hash ile doğrular.
+    Aynı kullanıcının tekrar eden girişlerinde pahalı KDF hesaplaması yerine önbellek kullanılır.
+    Sadece başarılı doğrulamalar önbelleğe alınır; hash değişirse (şifre güncellenirse) anahtar da değişir.
+    """
+    key = _verify_cache_key(stored_hash, password)
+    with _verify_cache_lock:
+        if key in _verify_cache:
+            _verify_cache.move_to_end(key)
+            return True
+
+    if not _check_password(stored_hash, password):
+        return False
+
+    with _verify_cache_lock:
+        _verify_cache[key] = True
+        if len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return True
+
+
+def verify_many(pairs):
+    """
+    (saklanan_hash, şifre) çiftlerini HASH_POOL üzerinde paralel doğrular.
+    Sonuçlar girişle aynı sırada bool listesi olarak döner.
+    """
+    return list(HASH_POOL.map(lambda pair: verify_password(*pair), pairs))
@@ -1,144 +1,514 @@
 # stok.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g, jsonify, send_file, make_response, current_app
 import sqlite3, os
+import re
+import hashlib
+import threading
 import pandas as pd
-import json # JSON işlemleri için
+import xlsxwriter
+try: # Biçimli Excel dışa aktarımı (?styled=1) için isteğe bağlı
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+except ImportError:
+    openpyxl = None
+from io import BytesIO
+import orjson # JSON işlemleri için (json modülünden hızlı)
 from decorators import login_required # Import the decorator
-from datetime import datetime # last_updated için
+from db_pool import SQLITE_PRAGMAS, get_pool
+from functools import lru_cache
+from itertools import groupby
+from collections import namedtuple
+from operator import itemgetter
+
+# orjson bytes döndürür; veritabanına TEXT olarak yazıldığı için str'e çevrilir
+_loads = orjson.loads
+_dumps = lambda obj: orjson.dumps(obj).decode()
 
 stok_bp = Blueprint('stok', __name__)
 
+# Her kullanıcı için dinamik stok veritabanlarını tutacak klasör
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STOCK_DB_DIR = os.path.join(BASE_DIR, 'stock_dbs')
+
+# Stok bağlantılarında bağlantı başına uygulanan SQLite ayarları.
+# journal_mode=WAL kalıcı olduğundan init_stock_table() içinde veritabanı başına bir kez ayarlanır.
+# foreign_keys=ON ile ürün silindiğinde envanter kayıtları da CASCADE ile silinir.
+STOCK_CONNECTION_PRAGMAS = '''
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-20000;
+    PRAGMA mmap_size=268435456;
+    PRAGMA foreign_keys=ON;
+'''
+
+# Salt okunur stok bağlantılarının ayarları. Bu bağlantılar yalnızca okuma ağırlıklı sayfalarda
+# (envanter listesi) kullanılır; WAL sayesinde yazıcıyı beklemezler ve daha büyük sayfa önbelleği tutarlar.
+STOCK_READ_PRAGMAS = '''
+    PRAGMA busy_timeout=5000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+'''
+
+# Sabit (sisteme ait) ürün sütunları; yeniden adlandırılamaz, gizlenemez
+_RESERVED = frozenset({'id', 'name', 'price', 'user_product_id'})
+
+# Sütun adında harf, rakam ve boşluk dışındaki karakterler (Türkçe harfler korunur)
+_SAFE_RE = re.compile(r'[^\w ]|_')
+
+def _quote_ident(name):
+    """SQL tanımlayıcısını (sütun adı) çift tırnak içine alır; addaki çift tırnaklar ikilenir."""
+    return '"' + name.replace('"', '""') + '"'
+
+def _safe_column_name(raw):
+    """Kullanıcının girdiği parametre adını SQL sütun adına çevirir: 'Renk Kodu' -> 'renk_kodu'."""
+    return _SAFE_RE.sub('', raw).strip().replace(' ', '_').lower()
+
+@lru_cache(maxsize=1024)
+def stock_db_path_for(user_id):
+    """Kullanıcının stok veritabanı yolunu döndürür; yol yalnızca kullanıcı ID'sine bağlıdır."""
+    return os.path.join(STOCK_DB_DIR, f'stock_{user_id}.db')
+
+# Bu süreçte şeması hazırlanmış stok veritabanı yolları
+_ready_stock_dbs = set()
+_ready_stock_dbs_lock = threading.Lock()
+
+def ensure_stock_db(db_path, user_id):
+    """
+    Stok veritabanını ilk erişimde oluşturur/günceller (init_stock_table).
+    Her veritabanı için süreç başına yalnızca bir kez çalışır.
+    """
+    if db_path in _ready_stock_dbs:
+        return
+    with _ready_stock_dbs_lock:
+        if db_path not in _ready_stock_dbs:
+            init_stock_table(db_path, user_id)
+            _ready_stock_dbs.add(db_path)
+
+# Kullanıcı başına stok veritabanı havuzunda boşta tutulacak bağlantı sayısı
+STOCK_POOL_SIZE = 4
+
+def get_stock_pool(db_path):
+    """Stok veritabanı için süreç genelindeki bağlantı havuzunu döndürür."""
+    return get_pool(db_path, size=STOCK_POOL_SIZE, pragmas=STOCK_CONNECTION_PRAGMAS)
+
+# İstek boyunca alınan stok bağlantılarının g üzerindeki adları; teardown bunların hepsini iade eder
+STOCK_CONN_G_KEYS = ('stock_db_conn', 'stock_read_conn')
+
+def _acquire_stock_conn(pool_getter, g_key):
+    """
+    get_stock_db() ve get_stock_read_db() için ortak gövde: veritabanını hazırlar, `pool_getter`'ın
+    döndürdüğü havuzdan bir bağlantı alır ve istek boyunca g üzerinde `g_key` adıyla tutar.
+    Bağlantının alındığı havuz da saklanır; teardown bağlantıyı aynı havuza iade eder.
+    """
+    conn = g.get(g_key)
+    if conn is not None:
+        return conn
+
+    user_id = g.get('user_id')
+    if not user_id:
+        raise RuntimeError("Kullanıcı session'da bulunamadı veya kullanıcı giriş yapmamış. Lütfen tekrar giriş yapın.")
+    ensure_stock_db(g.stock_db_path, user_id)
+    pool = pool_getter(g.stock_db_path)
+    conn = pool.acquire()
+    # Bir istekte tek kullanıcı olduğundan bağlantı sabit bir adla saklanır
+    setattr(g, g_key, conn)
+    setattr(g, f'{g_key}_pool', pool)
+    return conn
+
 def get_stock_db():
     """
     Kullanıcının stok modülü için veritabanı bağlantısını döndürür.
-    Bağlantı, kullanıcının session'ındaki 'stock_db_path' ile kurulur.
-    Her istek başına tek bir bağlantı olmasını sağlar.
+    Bağlantı yolu, before_stock_request()'te session'dan okunan g.user_id/g.stock_db_path'tir.
+    Veritabanı henüz yoksa ilk erişimde oluşturulur (WAL moduna geçiş de bu sırada, süreç başına bir kez yapılır).
+    Bağlantı, veritabanının havuzundan alınır ve istek boyunca g üzerinde tutulur.
     """
-    user_stock_db_path = session.get('stock_db_path')
-    if not user_stock_db_path:
-        raise RuntimeError("Kullanıcı stok veritabanı yolu session'da bulunamadı veya kullanıcı giriş yapmamış. Lütfen tekrar giriş yapın.")
+    return _acquire_stock_conn(get_stock_pool, 'stock_db_conn')
 
-    db_attribute_name = f'stock_db_conn_{session.get("user_id")}' 
+def get_stock_read_pool(db_path):
+    """Stok veritabanı için süreç genelindeki salt okunur (mode=ro) bağlantı havuzunu döndürür."""
+    return get_pool(db_path, size=STOCK_POOL_SIZE, readonly=True, pragmas=STOCK_READ_PRAGMAS)
 
-    if not hasattr(g, db_attribute_name):
-        conn = sqlite3.connect(user_stock_db_path)
-        conn.row_factory = sqlite3.Row # Kolon isimleriyle verilere erişim için
-        setattr(g, db_attribute_name, conn) # g nesnesine bağlantıyı kaydet
-    return getattr(g, db_attribute_name)
+def get_stock_read_db():
+    """
+    Kullanıcının stok veritabanı için salt okunur bir bağlantı döndürür (yalnızca SELECT yapan rotalar için).
+    Veritabanı get_stock_db()'deki gibi önce hazırlanır; bağlantı istek boyunca g üzerinde tutulur.
+    """
+    return _acquire_stock_conn(get_stock_read_pool, 'stock_read_conn')
 
 @stok_bp.before_request
 def before_stock_request():
     """
-    Her istek öncesinde stok veritabanı bağlantısını açar.
-    Bağlantı get_stock_db() içinde yönetiliyor ve session kontrolü orada yapılır.
+    Kullanıcı ID'sini ve stok veritabanı yolunu istek başında session'dan bir kez okuyup g'ye koyar;
+    rotalar session yerine g.user_id kullanır.
+    Bağlantı get_stock_db() içinde ilk ihtiyaçta alınır ve giriş kontrolü orada yapılır.
     """
-    pass 
+    g.user_id = session.get('user_id')
+    g.stock_db_path = stock_db_path_for(g.user_id) if g.user_id else None
 
 @stok_bp.teardown_request
 def teardown_stock_request(exception):
     """
-    Her istek sonunda stok veritabanı bağlantısını kapatır.
+    Her istek sonunda stok veritabanı bağlantılarını havuzlarına iade eder.
+    Yarım kalan işlem (ör. istek hata ile bittiyse) iade sırasında geri alınır.
     """
-    user_id = session.get('user_id')
-    if user_id:
-        db_attribute_name = f'stock_db_conn_{user_id}'
-        db = getattr(g, db_attribute_name, None)
-        if db is not None:
-            db.close()
+    for g_key in STOCK_CONN_G_KEYS:
+        conn = g.pop(g_key, None)
+        if conn is not None:
+            g.pop(f'{g_key}_pool').release(conn)
+
 
+# Stok veritabanı şema sürümü (PRAGMA user_version). init_stock_table()'daki şema
+# değiştiğinde artırılır; güncel sürümdeki veritabanlarında şema kontrolü atlanır.
+# 2: stock_columns.options her zaman JSON liste olarak saklanır.
+# 3: products(user_product_id) indeksi.
+# 4: ürün adı araması için products_fts (FTS5 trigram) tablosu ve senkron tetikleyicileri.
+# 5: envanter sayfasının ETag'i için tetikleyicilerle artan stock_changes sayacı.
+STOCK_SCHEMA_VERSION = 5
+
+def _sqlite_has_fts_trigram():
+    """
+    SQLite kütüphanesinin FTS5 'trigram' ayrıştırıcısını desteklediğini bellekte deneyerek doğrular.
+    Sürüm numarası yetmez: 3.34+ olup FTS5 olmadan derlenmiş kütüphaneler de vardır.
+    """
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(a, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+# Destek yoksa (SQLite < 3.34 veya FTS5'siz derleme) products_fts oluşturulmaz ve ürün adı araması
+# her uzunlukta düz LIKE ile yapılır.
+HAS_FTS_TRIGRAM = _sqlite_has_fts_trigram()
+
+def _legacy_options_list(options_str):
+    """
+    Eski sürümlerde yazılmış 'options' değerini listeye çevirir: önce JSON olarak okunur,
+    olmazsa virgülle ayrılmış metin (örn. "[a, 'b']") olarak ayrıştırılır.
+    Yalnızca init_stock_table() içindeki tek seferlik dönüşümde kullanılır.
+    """
+    options_str = options_str.strip()
+    try:
+        loaded_options = _loads(options_str)
+        return loaded_options if isinstance(loaded_options, list) else []
+    except orjson.JSONDecodeError:
+        cleaned_str = options_str.replace('[', '').replace(']', '').strip()
+        options_list = []
+        for opt in cleaned_str.split(','):
+            cleaned_opt = opt.strip().strip("'\"").replace('\\"', '"')
+            if cleaned_opt:
+                options_list.append(cleaned_opt)
+        return options_list
 
 def init_stock_table(db_path, user_id):
     """
     Kullanıcıya özel stok veritabanını oluşturur ve 'products', 'inventory',
     'stock_columns' ve 'user_column_visibility' tablolarını tanımlar.
-    Veritabanı zaten varsa bu işlemi yapmaz.
+    Veritabanının şema sürümü güncelse (ve destekleniyorsa products_fts mevcutsa) çıkılır;
+    değilse tüm oluşturma/güncelleme adımları tek bir işlemde (tek commit) yapılır.
     `db_path`: Stok veritabanının fiziksel yolu.
     `user_id`: Veritabanı başlatılan kullanıcının ID'si.
     """
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SQLITE_PRAGMAS)
+        schema_current = conn.execute('PRAGMA user_version').fetchone()[0] >= STOCK_SCHEMA_VERSION
+        if schema_current and HAS_FTS_TRIGRAM:
+            # Eski bir SQLite ile güncellenmiş veritabanında products_fts eksik olabilir; o zaman
+            # (tüm adımlar IF NOT EXISTS olduğundan) geçiş yeniden çalıştırılıp indeks oluşturulur.
+            schema_current = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'").fetchone() is not None
+        if schema_current:
+            # Sorgu planlayıcısının istatistikleri; yalnızca gerekiyorsa ANALYZE çalıştırır
+            conn.execute('PRAGMA optimize')
+            return
+
+        with conn: # Başarıyla biterse commit, hata olursa rollback
+            cursor = conn.cursor()
+            # CREATE/ALTER için sqlite3 kendiliğinden işlem açmaz; hepsini tek işlemde topla
+            cursor.execute('BEGIN')
         
-        # 1. 'products' tablosu
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_product_id INTEGER, 
-                name TEXT NOT NULL,
-                price REAL NOT NULL
-            )
-        ''')
-
-        # 2. 'inventory' tablosu (adet ve lokasyon gibi stok bilgileri)
-        # UNIQUE(product_id, location) eklendi
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL, -- products tablosuna referans
-                quantity INTEGER NOT NULL DEFAULT 0,
-                location TEXT NOT NULL DEFAULT '', -- Konum artık boş olamaz, varsayılan boş string
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
-                UNIQUE(product_id, location) -- Aynı ürünün aynı konumda sadece bir kaydı olabilir
-            )
-        ''')
-
-        # 3. 'stock_columns' tablosu (ürün özelliklerinin tanımları, bu veritabanı içinde)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS stock_columns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                column_name TEXT UNIQUE NOT NULL, 
-                column_type TEXT NOT NULL DEFAULT 'text', 
-                options TEXT 
-            )
-        ''')
+            # 1. 'products' tablosu
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_product_id INTEGER, 
+                    name TEXT NOT NULL,
+                    price REAL NOT NULL
+                )
+            ''')
+
+            # 2. 'inventory' tablosu (adet ve lokasyon gibi stok bilgileri)
+            # UNIQUE(product_id, location) eklendi
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS inventory (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER NOT NULL, -- products tablosuna referans
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    location TEXT NOT NULL DEFAULT '', -- Konum artık boş olamaz, varsayılan boş string
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+                    UNIQUE(product_id, location) -- Aynı ürünün aynı konumda sadece bir kaydı olabilir
+                )
+            ''')
+
+            # 3. 'stock_columns' tablosu (ürün özelliklerinin tanımları, bu veritabanı içinde)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stock_columns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    column_name TEXT UNIQUE NOT NULL, 
+                    column_type TEXT NOT NULL DEFAULT 'text', 
+                    options TEXT 
+                )
+            ''')
         
-        # 4. 'user_column_visibility' tablosu (bu kullanıcının sütun görünürlük tercihleri, bu DB içinde)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_column_visibility (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL, 
-                column_name TEXT NOT NULL,
-                is_visible INTEGER NOT NULL DEFAULT 1, 
-                UNIQUE(column_name) 
-            )
-        ''')
-
-        # 'products' tablosuna eksik olabilecek sütunları eklemek için kontrol
-        cursor.execute("PRAGMA table_info(products)")
-        product_table_columns = [row[1] for row in cursor.fetchall()]
-
-        if 'user_product_id' not in product_table_columns:
-            cursor.execute('ALTER TABLE products ADD COLUMN user_product_id INTEGER')
-        if 'name' not in product_table_columns:
-            cursor.execute('ALTER TABLE products ADD COLUMN name TEXT NOT NULL DEFAULT ""')
-        if 'price' not in product_table_columns:
-            cursor.execute('ALTER TABLE products ADD COLUMN price REAL NOT NULL DEFAULT 0.0')
-
-        # 'stock_columns' tablosundaki mevcut sütunlara column_type ve options ekle
-        cursor.execute("PRAGMA table_info(stock_columns)")
-        stock_columns_table_info = [row[1] for row in cursor.fetchall()]
-
-        if 'column_type' not in stock_columns_table_info:
-            cursor.execute('ALTER TABLE stock_columns ADD COLUMN column_type TEXT NOT NULL DEFAULT "text"')
-        if 'options' not in stock_columns_table_info:
-            cursor.execute('ALTER TABLE stock_columns ADD COLUMN options TEXT')
+            # 4. 'user_column_visibility' tablosu (bu kullanıcının sütun görünürlük tercihleri, bu DB içinde)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_column_visibility (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL, 
+                    column_name TEXT NOT NULL,
+                    is_visible INTEGER NOT NULL DEFAULT 1, 
+                    UNIQUE(column_name) 
+                )
+            ''')
+
+            # 'products' tablosuna eksik olabilecek sütunları eklemek için kontrol
+            cursor.execute("PRAGMA table_info(products)")
+            product_table_columns = [row[1] for row in cursor.fetchall()]
+
+            if 'user_product_id' not in product_table_columns:
+                cursor.execute('ALTER TABLE products ADD COLUMN user_product_id INTEGER')
+            if 'name' not in product_table_columns:
+                cursor.execute('ALTER TABLE products ADD COLUMN name TEXT NOT NULL DEFAULT ""')
+            if 'price' not in product_table_columns:
+                cursor.execute('ALTER TABLE products ADD COLUMN price REAL NOT NULL DEFAULT 0.0')
+
+            # İndeksler: inventory'deki UNIQUE(product_id, location) ve user_column_visibility'deki
+            # UNIQUE(column_name) SQLite'ın otomatik indeksleriyle zaten karşılanır (ürün silmedeki CASCADE
+            # ve görünürlük sorguları bunları kullanır); aynı sütunlara ikinci bir indeks eklenmez.
+            # add_product'taki MAX(user_product_id) sorgusu tabloyu taramak yerine indeksin son kaydını okur
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_user_product_id ON products(user_product_id)')
+
+            if HAS_FTS_TRIGRAM:
+                # Ürün adında alt metin araması (LIKE '%...%') için FTS5 trigram indeksi. Tablo 'products'
+                # içeriğini kopyalamaz (content='products'); tetikleyiciler indeksi güncel tutar.
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts
+                    USING fts5(name, content='products', content_rowid='id', tokenize='trigram')
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+                        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    END
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+                    END
+                ''')
+                # Mevcut ürünleri indekse ekle (yeni veritabanında boş tablo üzerinde anında biter)
+                cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+            # Envanter sayfasını etkileyen her değişiklikte artan tek satırlık sayaç. Silmeleri ve ürün
+            # güncellemelerini de kapsadığı için MAX(last_updated)'ten farklı olarak ETag'i güvenilir kılar.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stock_changes (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    counter INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('INSERT OR IGNORE INTO stock_changes (id, counter) VALUES (1, 0)')
+            for trigger_name, trigger_event in (
+                ('products_changes_ai', 'INSERT ON products'),
+                ('products_changes_ad', 'DELETE ON products'),
+                ('products_changes_au', 'UPDATE OF user_product_id, name, price ON products'),
+                ('inventory_changes_ai', 'INSERT ON inventory'),
+                ('inventory_changes_ad', 'DELETE ON inventory'),
+                ('inventory_changes_au', 'UPDATE ON inventory'),
+            ):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {trigger_event} BEGIN
+                        UPDATE stock_changes SET counter = counter + 1 WHERE id = 1;
+                    END
+                ''')
+
+            # 'stock_columns' tablosundaki mevcut sütunlara column_type ve options ekle
+            cursor.execute("PRAGMA table_info(stock_columns)")
+            stock_columns_table_info = [row[1] for row in cursor.fetchall()]
+
+            if 'column_type' not in stock_columns_table_info:
+                cursor.execute('ALTER TABLE stock_columns ADD COLUMN column_type TEXT NOT NULL DEFAULT "text"')
+            if 'options' not in stock_columns_table_info:
+                cursor.execute('ALTER TABLE stock_columns ADD COLUMN options TEXT')
             
-        # 'inventory' tablosundaki sütunları kontrol et (yeni sütun eklenmesi durumunda)
-        cursor.execute("PRAGMA table_info(inventory)")
-        inventory_table_columns = [row[1] for row in cursor.fetchall()]
-        if 'product_id' not in inventory_table_columns:
-            cursor.execute('ALTER TABLE inventory ADD COLUMN product_id INTEGER')
-        if 'quantity' not in inventory_table_columns:
-            cursor.execute('ALTER TABLE inventory ADD COLUMN quantity INTEGER NOT NULL DEFAULT 0')
-        # location sütununa NOT NULL ve DEFAULT '' eklendiği için kontrolü farklı olabilir
-        # Eğer mevcutsa ve eski sürümde NULL olabiliyorsa, UPDATE ile boş stringe çevirmek gerekebilir.
-        if 'location' not in inventory_table_columns:
-            cursor.execute('ALTER TABLE inventory ADD COLUMN location TEXT NOT NULL DEFAULT ""')
-        if 'last_updated' not in inventory_table_columns:
-            cursor.execute('ALTER TABLE inventory ADD COLUMN last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-
-        conn.commit()
+            # 'inventory' tablosundaki sütunları kontrol et (yeni sütun eklenmesi durumunda)
+            cursor.execute("PRAGMA table_info(inventory)")
+            inventory_table_columns = [row[1] for row in cursor.fetchall()]
+            if 'product_id' not in inventory_table_columns:
+                cursor.execute('ALTER TABLE inventory ADD COLUMN product_id INTEGER')
+            if 'quantity' not in inventory_table_columns:
+                cursor.execute('ALTER TABLE inventory ADD COLUMN quantity INTEGER NOT NULL DEFAULT 0')
+            # location sütununa NOT NULL ve DEFAULT '' eklendiği için kontrolü farklı olabilir
+            # Eğer mevcutsa ve eski sürümde NULL olabiliyorsa, UPDATE ile boş stringe çevirmek gerekebilir.
+            if 'location' not in inventory_table_columns:
+                cursor.execute('ALTER TABLE inventory ADD COLUMN location TEXT NOT NULL DEFAULT ""')
+            if 'last_updated' not in inventory_table_columns:
+                cursor.execute('ALTER TABLE inventory ADD COLUMN last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+
+            # Eski biçimdeki (JSON olmayan) seçenek listelerini JSON'a çevir; okuyucular yalnızca _loads kullanır
+            cursor.execute("SELECT id, options FROM stock_columns WHERE options IS NOT NULL AND options != ''")
+            for col_id, options_str in cursor.fetchall():
+                options_json = _dumps(_legacy_options_list(options_str))
+                if options_json != options_str:
+                    cursor.execute('UPDATE stock_columns SET options = ? WHERE id = ?', (options_json, col_id))
+
+            cursor.execute(f'PRAGMA user_version = {STOCK_SCHEMA_VERSION}')
+
+        # Şema/indeks değişikliğinden sonra planlayıcı istatistiklerini yenile
+        conn.execute('ANALYZE')
+
         print(f"Stok veritabanı oluşturuldu/güncellendi: {db_path} for user {user_id}")
+    finally:
+        conn.close()
+
+
+@lru_cache(maxsize=256)
+def _decode_options(options_str):
+    """
+    stock_columns.options değerini (JSON liste veya NULL) değiştirilemez bir demete çevirir.
+    Sonuç ham JSON metnine göre süreç genelinde önbelleklenir; seçenekler değişince metin de
+    değiştiği için önbelleğin ayrıca temizlenmesi gerekmez.
+    """
+    return tuple(_loads(options_str)) if options_str else ()
+
+def _get_schema(db):
+    """
+    'products' tablosunun sütun adlarını ve 'stock_columns' tanımlarını döndürür:
+    (all_product_column_names, dynamic_columns_info_dict).
+    Sonuç istek boyunca g üzerinde saklanır; şemayı değiştiren rotalar commit sonrası
+    g._stok_schema = None yaparak önbelleği geçersiz kılar.
+    """
+    schema = g.get('_stok_schema')
+    if schema is not None:
+        return schema
+
+    cursor = db.cursor()
+    cursor.execute('SELECT name FROM pragma_table_info(\'products\')') 
+    all_product_column_names = [name for name, in cursor.fetchall()]
+
+    dynamic_columns_info_dict = {} 
+    cursor.execute('SELECT column_name, column_type, options FROM stock_columns')
+    # sqlite3.Row'da ad ile erişim yerine demet açma (tuple unpacking) kullanılır
+    for column_name, column_type, options in cursor.fetchall():
+        dynamic_columns_info_dict[column_name] = {
+            'column_type': column_type,
+            'options': _decode_options(options)
+        }
+
+    g._stok_schema = (all_product_column_names, dynamic_columns_info_dict)
+    return g._stok_schema
+
+
+# Dinamik ürün parametreleri için form doğrulayıcıları: (etiket, seçenekler, değer) -> kaydedilecek değer.
+# Geçersiz değerde, kullanıcıya gösterilecek mesajla ValueError fırlatır.
+def _validate_text(label, options, value):
+    return value
+
+def _validate_number(label, options, value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        raise ValueError(f'"{label}" parametresi sayısal bir değer olmalıdır.')
+
+def _validate_select(label, options, value):
+    if value and value not in options:
+        raise ValueError(f'"{label}" için geçersiz seçenek seçildi.')
+    return value
+
+_VALIDATORS = {'number': _validate_number, 'select': _validate_select}
+
+def _get_product_validators(db):
+    """
+    Dinamik sütunlar için (sütun_adı, etiket, doğrulayıcı, seçenekler) listesini döndürür.
+    Liste, _get_schema() sonucundan istek başına bir kez kurulur; şema önbelleği
+    geçersiz kılınınca (g._stok_schema = None) yeniden kurulur. Seçenekler frozenset'tir.
+    """
+    schema = _get_schema(db)
+    cached = g.get('_stok_validators')
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+
+    all_product_column_names, dynamic_columns_info_dict = schema
+    validators = []
+    for col_name in all_product_column_names:
+        if col_name in _RESERVED:
+            continue
+        col_info = dynamic_columns_info_dict.get(col_name, {})
+        validators.append((
+            col_name,
+            col_name.replace('_', ' ').title(),
+            _VALIDATORS.get(col_info.get('column_type'), _validate_text),
+            frozenset(col_info.get('options', ())),
+        ))
+    g._stok_validators = (schema, validators)
+    return validators
+
+def _read_product_form(db):
+    """
+    Formdaki dinamik parametre değerlerini doğrular ve (sütunlar, değerler) listelerini döndürür.
+    Geçersiz bir değerde flash mesajını taşıyan ValueError fırlatır.
+    """
+    columns = []
+    values = []
+    for col_name, label, validate, options in _get_product_validators(db):
+        columns.append(col_name)
+        values.append(validate(label, options, request.form.get(col_name, '').strip()))
+    return columns, values
+
+
+def _product_column_exists(cursor, column_name):
+    """'products' tablosunda (büyük/küçük harf duyarsız) bu adda bir sütun olup olmadığını döndürür."""
+    cursor.execute("SELECT 1 FROM pragma_table_info('products') WHERE lower(name) = ? LIMIT 1", (column_name.lower(),))
+    return cursor.fetchone() is not None
+
+def _get_column_visibility(db, user_id):
+    """
+    'products' tablosundaki her sütunun görünürlüğünü {sütun_adı: bool} olarak döndürür.
+    Tercihi kaydedilmemiş sütunlar görünür (1) sayılır; varsayılanlar SQL'de LEFT JOIN ile çözülür.
+    """
+    cursor = db.execute('''
+        SELECT c.name, COALESCE(v.is_visible, 1)
+        FROM pragma_table_info('products') AS c
+        LEFT JOIN user_column_visibility AS v ON v.column_name = c.name AND v.user_id = ?
+    ''', (user_id,))
+    return {column_name: bool(is_visible) for column_name, is_visible in cursor}
+
+
+# Ürün INSERT/UPDATE sorguları sütun listesine göre bir kez oluşturulur. Sütun listesi yalnızca
+# şema değişince (add_column/rename_column) değiştiği için aynı SQL metni tekrar kullanılır ve
+# sqlite3'ün bağlantı başına deyim önbelleği sorguyu yeniden derlemez.
+# Sütun adları tırnaklanır (_quote_ident); tırnaklama da önbellekte bir kez yapılır.
+@lru_cache(maxsize=256)
+def _insert_product_sql(columns):
+    placeholders = ', '.join(['?'] * len(columns))
+    return f'INSERT INTO products ({", ".join(map(_quote_ident, columns))}) VALUES ({placeholders})'
+
+@lru_cache(maxsize=256)
+def _update_product_sql(columns):
+    set_expr = ', '.join(f'{_quote_ident(col_name)} = ?' for col_name in columns)
+    return f'UPDATE products SET {set_expr} WHERE id = ?'
 
 
 @stok_bp.route('/stok')
@@ -148,7 +518,7 @@ def stok_listesi():
     Kullanıcının ürün listesini ve dinamik parametre ekleme formlarını gösterir.
     Bu artık 'Ürün Tanımları' sayfasıdır.
     """
-    user_id = session.get('user_id')
+    user_id = g.user_id
     db = get_stock_db() 
     cursor = db.cursor()
 
@@ -161,43 +531,7 @@ def stok_listesi():
             flash("Düzenlenecek ürün bulunamadı veya yetkiniz yok.", "danger")
             return redirect(url_for('stok.stok_listesi'))
 
-    cursor.execute('PRAGMA table_info(products)') 
-    product_table_columns_info = cursor.fetchall()
-    all_product_column_names = [col['name'] for col in product_table_columns_info]
-    
-    dynamic_columns_info_dict = {} 
-    cursor.execute('SELECT column_name, column_type, options FROM stock_columns')
-    for row in cursor.fetchall():
-        options_list = []
-        db_options_str = row['options'] 
-
-        if db_options_str: 
-            db_options_str = db_options_str.strip() 
-            try:
-                loaded_options = json.loads(db_options_str)
-                if isinstance(loaded_options, list): 
-                    options_list = loaded_options
-                else:
-                    options_list = []
-            except json.JSONDecodeError as e:
-                cleaned_str = db_options_str.replace('[', '').replace(']', '').strip() 
-                if cleaned_str: 
-                    temp_list = []
-                    for opt in cleaned_str.split(','):
-                        cleaned_opt = opt.strip().strip("'\"").replace('\\"', '"')
-                        if cleaned_opt: 
-                            temp_list.append(cleaned_opt)
-                    options_list = temp_list
-                else:
-                    options_list = [] 
-
-        if not isinstance(options_list, list):
-            options_list = [] 
-        
-        dynamic_columns_info_dict[row['column_name']] = {
-            'column_type': row['column_type'],
-            'options': options_list 
-        }
+    all_product_column_names, dynamic_columns_info_dict = _get_schema(db)
 
     fixed_columns_meta = {
         'id': {'column_type': 'number', 'options': []}, 
@@ -214,25 +548,15 @@ def stok_listesi():
             elif col_name in dynamic_columns_info_dict:
                 columns_for_form.append({'name': col_name, **dynamic_columns_info_dict[col_name]})
 
-    all_display_columns_with_info = [] 
-    for col_name in all_product_column_names:
-        if col_name not in ('id',): 
-            if col_name in fixed_columns_meta:
-                all_display_columns_with_info.append({'name': col_name, **fixed_columns_meta[col_name]})
-            elif col_name in dynamic_columns_info_dict:
-                all_display_columns_with_info.append({'name': col_name, **dynamic_columns_info_dict[col_name]})
-    
-    column_visibility_preferences = {}
-    cursor.execute('SELECT column_name, is_visible FROM user_column_visibility WHERE user_id = ?', (user_id,))
-    for row in cursor.fetchall():
-        column_visibility_preferences[row['column_name']] = bool(row['is_visible'])
-    
-    for col_info in all_display_columns_with_info:
-        col_name = col_info['name']
-        if col_name not in column_visibility_preferences:
-            column_visibility_preferences[col_name] = True 
+    # Tablo başlıkları form sütunlarıyla aynıdır; ikinci bir liste kurulmaz
+    all_display_columns_with_info = columns_for_form
+
+    column_visibility_preferences = _get_column_visibility(db, user_id)
 
-    cursor.execute('SELECT * FROM products') 
+    # Yalnızca şablonun gösterdiği sütunlar okunur. Gizli sütunlar da sayfada (d-none ile) yer aldığından
+    # görünürlüğe göre değil, columns_for_form'a göre seçilir. Adlar PRAGMA table_info'dan geldiği için güvenlidir.
+    projection = ['id'] + [col_info['name'] for col_info in columns_for_form]
+    cursor.execute(f"SELECT {', '.join(map(_quote_ident, projection))} FROM products") 
     product_data = cursor.fetchall()
 
     return render_template('stok.html', 
@@ -251,7 +575,7 @@ def add_column():
     """
     db = get_stock_db() 
     cursor = db.cursor()
-    user_id = session.get('user_id') 
+    user_id = g.user_id 
 
     new_col_raw = request.form['new_column'].strip()
     column_type = request.form.get('column_type', 'text') 
@@ -261,8 +585,8 @@ def add_column():
         flash('Parametre adı boş bırakılamaz.', 'danger')
         return redirect(url_for('stok.stok_listesi'))
 
-    new_col = ''.join(c for c in new_col_raw if c.isalnum() or c == ' ').replace(' ', '_').lower()
-    if not new_col or new_col in ['id', 'name', 'price', 'user_product_id']: 
+    new_col = _safe_column_name(new_col_raw)
+    if not new_col or new_col in _RESERVED: 
         flash('Geçersiz veya sisteme ait bir parametre adı girdiniz.', 'danger')
         return redirect(url_for('stok.stok_listesi'))
 
@@ -272,27 +596,28 @@ def add_column():
         if not options_list:
             flash('Seçenekli parametre için en az bir seçenek girilmelidir.', 'danger')
             return redirect(url_for('stok.stok_listesi'))
-        options_json = json.dumps(options_list)
+        options_json = _dumps(options_list)
 
     try:
-        cursor.execute("PRAGMA table_info(products)")
-        existing_product_columns = [row['name'].lower() for row in cursor.fetchall()]
-
-        if new_col in existing_product_columns:
+        if _product_column_exists(cursor, new_col):
             flash(f'"{new_col_raw}" adında bir parametre zaten mevcut. Lütfen başka bir ad seçin.', 'warning')
         else:
-            cursor.execute(f'ALTER TABLE products ADD COLUMN {new_col} TEXT DEFAULT ""') 
-            
-            cursor.execute('''
-                INSERT OR IGNORE INTO stock_columns (column_name, column_type, options) 
-                VALUES (?, ?, ?)
-            ''', (new_col, column_type, options_json))
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_column_visibility (user_id, column_name, is_visible)
-                VALUES (?, ?, ?)
-            ''', (user_id, new_col, 1)) 
-            db.commit()
+            # ALTER ve iki INSERT tek işlemde: tek commit (tek WAL senkronizasyonu), hata olursa hepsi geri alınır.
+            # sqlite3 DDL öncesinde kendiliğinden işlem açmadığı için BEGIN açıkça verilir.
+            with db:
+                cursor.execute('BEGIN')
+                cursor.execute(f'ALTER TABLE products ADD COLUMN {_quote_ident(new_col)} TEXT DEFAULT ""') 
+
+                cursor.execute('''
+                    INSERT OR IGNORE INTO stock_columns (column_name, column_type, options) 
+                    VALUES (?, ?, ?)
+                ''', (new_col, column_type, options_json))
+
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_column_visibility (user_id, column_name, is_visible)
+                    VALUES (?, ?, ?)
+                ''', (user_id, new_col, 1)) 
+            g._stok_schema = None # Şema değişti, önbelleği geçersiz kıl
             flash(f'"{new_col_raw}" parametresi ({column_type}) başarıyla eklendi.', 'success')
     except sqlite3.IntegrityError:
         flash(f'Veritabanı hatası: "{new_col_raw}" adında bir parametre zaten mevcut veya başka bir çakışma oldu.', 'danger')
@@ -310,42 +635,13 @@ def add_product():
     """
     'products' tablosuna yeni bir ürün ekler ve 'inventory' tablosuna varsayılan adet ile kayıt ekler.
     """
-    user_id = session.get('user_id')
+    user_id = g.user_id
     db = get_stock_db() 
     cursor = db.cursor()
 
-    cursor.execute('PRAGMA table_info(products)') 
-    columns_info = cursor.fetchall()
-    all_product_column_names = [col['name'] for col in columns_info]
-    
-    dynamic_columns_info_dict = {}
-    cursor.execute('SELECT column_name, column_type, options FROM stock_columns')
-    for row in cursor.fetchall():
-        options_list = []
-        if row['options']:
-            try:
-                loaded_options = json.loads(row['options'])
-                if isinstance(loaded_options, list):
-                    options_list = loaded_options
-            except json.JSONDecodeError:
-                cleaned_str = row['options'].strip()
-                cleaned_str = cleaned_str.replace('[', '').replace(']', '').strip()
-                options_list = [
-                    opt.strip().strip("'\"").replace('\\"', '"')
-                    for opt in cleaned_str.split(',') if opt.strip()
-                ]
-        dynamic_columns_info_dict[row['column_name']] = {
-            'column_type': row['column_type'],
-            'options': options_list
-        }
-
-    cursor.execute('SELECT MAX(user_product_id) FROM products') 
-    result = cursor.fetchone()[0]
-    max_user_id = int(result) if result is not None and str(result).strip() != '' else 0
-    next_user_id = max_user_id + 1
-
+    # user_product_id, yazma kilidi alındıktan sonra işlemin içinde belirlenir (aşağıda)
     insert_columns = ['user_product_id'] 
-    insert_values = [next_user_id]
+    insert_values = [None]
 
     name = request.form.get('name', '').strip()
     price_str = request.form.get('price', '').strip()
@@ -365,37 +661,26 @@ def add_product():
     insert_columns.append('price')
     insert_values.append(price)
 
-    for col_name in all_product_column_names:
-        if col_name not in ['id', 'user_product_id', 'name', 'price']: 
-            col_type = dynamic_columns_info_dict.get(col_name, {}).get('column_type', 'text')
-            col_options = dynamic_columns_info_dict.get(col_name, {}).get('options', [])
-            value = request.form.get(col_name, '').strip()
-
-            if col_type == 'number':
-                try:
-                    value = float(value) if value else None 
-                except ValueError:
-                    flash(f'"{col_name.replace("_", " ").title()}" parametresi sayısal bir değer olmalıdır.', 'danger')
-                    return redirect(url_for('stok.stok_listesi'))
-            elif col_type == 'select':
-                if value and value not in col_options:
-                    flash(f'"{col_name.replace("_", " ").title()}" için geçersiz seçenek seçildi.', 'danger')
-                    return redirect(url_for('stok.stok_listesi'))
-                
-            insert_columns.append(col_name)
-            insert_values.append(value)
-            
-    placeholders = ', '.join(['?'] * len(insert_values))
-    column_str = ', '.join(insert_columns)
+    try:
+        form_columns, form_values = _read_product_form(db)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('stok.stok_listesi'))
+    insert_columns.extend(form_columns)
+    insert_values.extend(form_values)
 
     try:
-        cursor.execute(f'INSERT INTO products ({column_str}) VALUES ({placeholders})', insert_values)
-        product_id = cursor.lastrowid 
+        with db: # Ürün ve envanter kaydı tek işlemde (tek commit); hata olursa ikisi de geri alınır
+            # Yazma kilidi baştan alınır; eşzamanlı eklemeler (başka worker'lar dahil) aynı MAX değerini okuyamaz
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(user_product_id), 0) FROM products') # idx_products_user_product_id ile O(log n)
+            insert_values[0] = cursor.fetchone()[0] + 1
+            cursor.execute(_insert_product_sql(tuple(insert_columns)), insert_values)
+            product_id = cursor.lastrowid 
 
-        # Ürün oluşturulduğunda varsayılan olarak bir envanter kaydı ekleyelim (konumsuz, 0 adet)
-        cursor.execute('INSERT INTO inventory (product_id, quantity, location) VALUES (?, ?, ?)', (product_id, 0, ''))
+            # Ürün oluşturulduğunda varsayılan olarak bir envanter kaydı ekleyelim (konumsuz, 0 adet)
+            cursor.execute('INSERT INTO inventory (product_id, quantity, location) VALUES (?, ?, ?)', (product_id, 0, ''))
 
-        db.commit()
         flash("Ürün başarıyla eklendi.", "success")
     except Exception as e:
         flash(f'Ürün eklenirken bir hata oluştu: {e}', "danger")
@@ -435,32 +720,7 @@ def update_product(product_id):
     db = get_stock_db() 
     cursor = db.cursor()
 
-    cursor.execute('PRAGMA table_info(products)') 
-    columns_info = cursor.fetchall()
-    all_product_column_names = [col['name'] for col in columns_info]
-    
-    dynamic_columns_info_dict = {}
-    cursor.execute('SELECT column_name, column_type, options FROM stock_columns')
-    for row in cursor.fetchall():
-        options_list = []
-        if row['options']:
-            try:
-                loaded_options = json.loads(row['options'])
-                if isinstance(loaded_options, list):
-                    options_list = loaded_options
-            except json.JSONDecodeError:
-                cleaned_str = row['options'].strip()
-                cleaned_str = cleaned_str.replace('[', '').replace(']', '').strip()
-                options_list = [
-                    opt.strip().strip("'\"").replace('\\"', '"')
-                    for opt in cleaned_str.split(',') if opt.strip()
-                ]
-        dynamic_columns_info_dict[row['column_name']] = {
-            'column_type': row['column_type'],
-            'options': options_list
-        }
-
-    update_set_parts = []
+    update_columns = []
     update_values = []
 
     name = request.form.get('name', '').strip()
@@ -476,35 +736,21 @@ def update_product(product_id):
         flash("Fiyat geçerli bir sayı olmalıdır.", "danger")
         return redirect(url_for('stok.stok_listesi'))
 
-    update_set_parts.append(f"name = ?")
+    update_columns.append('name')
     update_values.append(name)
-    update_set_parts.append(f"price = ?")
+    update_columns.append('price')
     update_values.append(price)
 
-    for col_name in all_product_column_names:
-        if col_name not in ['id', 'user_product_id', 'name', 'price']: 
-            col_type = dynamic_columns_info_dict.get(col_name, {}).get('column_type', 'text')
-            col_options = dynamic_columns_info_dict.get(col_name, {}).get('options', [])
-            value = request.form.get(col_name, '').strip()
-
-            if col_type == 'number':
-                try:
-                    value = float(value) if value else None
-                except ValueError:
-                    flash(f'"{col_name.replace("_", " ").title()}" parametresi sayısal bir değer olmalıdır.', 'danger')
-                    return redirect(url_for('stok.stok_listesi'))
-            elif col_type == 'select':
-                if value and value not in col_options:
-                    flash(f'"{col_name.replace("_", " ").title()}" için geçersiz seçenek seçildi.', 'danger')
-                    return redirect(url_for('stok.stok_listesi'))
-            
-            update_set_parts.append(f"{col_name} = ?")
-            update_values.append(value)
-            
-    set_expr = ', '.join(update_set_parts)
+    try:
+        form_columns, form_values = _read_product_form(db)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('stok.stok_listesi'))
+    update_columns.extend(form_columns)
+    update_values.extend(form_values)
 
     try:
-        cursor.execute(f'UPDATE products SET {set_expr} WHERE id = ?', (*update_values, product_id))
+        cursor.execute(_update_product_sql(tuple(update_columns)), (*update_values, product_id))
         db.commit()
         if cursor.rowcount > 0:
             flash("Ürün başarıyla güncellendi.", "success")
@@ -521,7 +767,7 @@ def rename_column():
     """
     'products' tablosundaki bir sütunun adını değiştirir.
     """
-    user_id = session.get('user_id') 
+    user_id = g.user_id 
     db = get_stock_db() 
     cursor = db.cursor()
 
@@ -532,30 +778,28 @@ def rename_column():
         flash("Hem eski hem de yeni parametre adı girilmelidir.", "danger")
         return redirect(url_for('stok.stok_listesi'))
 
-    new_column_safe_name = ''.join(c for c in new_column_raw if c.isalnum() or c == ' ').replace(' ', '_').lower()
+    new_column_safe_name = _safe_column_name(new_column_raw)
 
-    if not new_column_safe_name or new_column_safe_name in ['id', 'name', 'price', 'user_product_id']:
+    if not new_column_safe_name or new_column_safe_name in _RESERVED:
         flash('Yeni parametre adı geçersiz veya sisteme ait bir isim olamaz.', 'danger')
         return redirect(url_for('stok.stok_listesi'))
 
     try:
-        cursor.execute("PRAGMA table_info(products)")
-        existing_columns = [row['name'].lower() for row in cursor.fetchall()]
-
-        if old_column_name.lower() not in existing_columns:
+        if not _product_column_exists(cursor, old_column_name):
             flash(f'"{old_column_name.replace("_", " ").title()}" adında bir parametre bulunamadı.', 'danger')
             return redirect(url_for('stok.stok_listesi'))
         
-        if new_column_safe_name in existing_columns:
+        if _product_column_exists(cursor, new_column_safe_name):
             flash(f'"{new_column_raw}" adında bir parametre zaten mevcut. Lütfen başka bir ad seçin.', 'warning')
             return redirect(url_for('stok.stok_listesi'))
 
-        cursor.execute(f'ALTER TABLE products RENAME COLUMN {old_column_name} TO {new_column_safe_name}')
+        cursor.execute(f'ALTER TABLE products RENAME COLUMN {_quote_ident(old_column_name)} TO {_quote_ident(new_column_safe_name)}')
         
         cursor.execute('UPDATE stock_columns SET column_name = ? WHERE column_name = ?', (new_column_safe_name, old_column_name))
         
         cursor.execute('UPDATE user_column_visibility SET column_name = ? WHERE column_name = ? AND user_id = ?', (new_column_safe_name, old_column_name, user_id))
         db.commit()
+        g._stok_schema = None # Şema değişti, önbelleği geçersiz kıl
         flash(f'Parametre adı "{old_column_name.replace("_", " ").title()}" başarıyla "{new_column_raw}" olarak değiştirildi.', 'success')
     except sqlite3.OperationalError as e:
         flash(f'Parametre adı değiştirilirken bir hata oluştu: {e}', 'danger')
@@ -582,7 +826,7 @@ def update_column_options():
 
     options_list = [opt.strip() for opt in options_raw.split(',') if opt.strip()]
     
-    options_json = json.dumps(options_list) 
+    options_json = _dumps(options_list) 
 
     try:
         cursor.execute('SELECT column_type FROM stock_columns WHERE column_name = ?', (column_name,))
@@ -596,6 +840,7 @@ def update_column_options():
 
         cursor.execute('UPDATE stock_columns SET options = ? WHERE column_name = ?', (options_json, column_name))
         db.commit()
+        g._stok_schema = None # Seçenekler değişti, önbelleği geçersiz kıl
         return jsonify({'status': 'success', 'message': f'"{column_name.replace("_", " ").title()}" parametresinin seçenekleri başarıyla güncellendi.'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Seçenekler güncellenirken bir hata oluştu: {e}'}), 500
@@ -608,7 +853,7 @@ def toggle_column_visibility():
     Kullanıcının belirli bir sütunun görünürlüğünü açıp kapatmasını sağlar.
     Tercihler veritabanında saklanır. Bu işlem artık flash mesajı göstermez.
     """
-    user_id = session.get('user_id')
+    user_id = g.user_id
     db = get_stock_db() 
     cursor = db.cursor()
 
@@ -618,7 +863,7 @@ def toggle_column_visibility():
     if not column_name:
         return jsonify({'status': 'error', 'message': 'Sütun adı boş olamaz.'}), 400
 
-    if column_name in ['id', 'name', 'price', 'user_product_id']: 
+    if column_name in _RESERVED: 
         return jsonify({'status': 'error', 'message': f'"{column_name}" sütununun görünürlüğü değiştirilemez.'}), 403
 
     try:
@@ -632,6 +877,62 @@ def toggle_column_visibility():
         return jsonify({'status': 'error', 'message': f'Error updating column visibility: {e}'}), 500
 
 
+@lru_cache(maxsize=64)
+def _build_export_sql(columns):
+    """Dışa aktarım sorgusunu sütun kümesi başına bir kez oluşturur (aynı metin, sqlite3 deyim önbelleğinde kalır)."""
+    return f'SELECT {", ".join(map(_quote_ident, columns))} FROM products'
+
+# Excel dışa aktarımında veritabanından tek seferde okunan satır sayısı
+EXPORT_FETCH_SIZE = 2000
+
+def _iter_export_rows(cursor):
+    """Sorgu sonucunu EXPORT_FETCH_SIZE'lık parçalar halinde okur; bellekte hiçbir zaman tüm tablo tutulmaz."""
+    cursor.arraysize = EXPORT_FETCH_SIZE
+    while True:
+        chunk = cursor.fetchmany()
+        if not chunk:
+            break
+        yield from chunk
+
+def _write_export_xlsxwriter(output, columns, cursor):
+    """
+    Varsayılan (hızlı) dışa aktarım: satırlar DataFrame kurulmadan doğrudan xlsxwriter'a yazılır.
+    constant_memory modunda yazılan satırlar bellekte tutulmaz (satırlar sırayla yazılmalıdır). Bu mod
+    in_memory ile birlikte kullanılamadığından xlsxwriter geçici dosya kullanır; çıktı yine output'a yazılır.
+    NULL hücreler boş bırakılır.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('ÜrünVerileri')
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    worksheet.write_row(0, 0, columns, header_format)
+    for row_index, row in enumerate(_iter_export_rows(cursor), start=1):
+        worksheet.write_row(row_index, 0, row)
+    workbook.close()
+
+def _write_export_openpyxl(output, columns, cursor):
+    """
+    Biçimli dışa aktarım (?styled=1): openpyxl write-only çalışma kitabı ile kalın, ortalanmış ve
+    dondurulmuş başlık satırı. Write-only modda da satırlar bellekte birikmez. Başlık hücreleri aynı
+    stil nesnelerini paylaşır; veri hücrelerine stil uygulanmaz.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('ÜrünVerileri')
+    worksheet.freeze_panes = 'A2'
+    header_font = Font(bold=True)
+    header_alignment = Alignment(horizontal='center')
+    header_border = Border(bottom=Side(style='thin'))
+    header_cells = []
+    for col_name in columns:
+        cell = WriteOnlyCell(worksheet, value=col_name)
+        cell.font = header_font
+        cell.alignment = header_alignment
+        cell.border = header_border
+        header_cells.append(cell)
+    worksheet.append(header_cells)
+    for row in _iter_export_rows(cursor):
+        worksheet.append(row)
+    workbook.save(output)
+
 @stok_bp.route('/stok/export')
 @login_required
 def export_excel():
@@ -639,41 +940,15 @@ def export_excel():
     Ürün verilerini kullanıcının görünürlük tercihlerine göre Excel dosyası olarak dışa aktarır.
     Sadece tabloda görünen sütunlar (ve temel sütunlar) dışa aktarılır.
     Bu artık 'products' tablosu içindir. Envanter bilgisi dahil edilmemiştir.
+    ?styled=1 ile (openpyxl kuruluysa) biçimli başlık ve dondurulmuş ilk satır içeren dosya üretilir.
     """
-    user_id = session.get('user_id')
+    user_id = g.user_id
     db = get_stock_db() 
     cursor = db.cursor()
 
-    column_visibility_preferences = {}
-    cursor.execute('SELECT column_name, is_visible FROM user_column_visibility WHERE user_id = ?', (user_id,))
-    for row in cursor.fetchall():
-        column_visibility_preferences[row['column_name']] = bool(row['is_visible'])
+    column_visibility_preferences = _get_column_visibility(db, user_id)
 
-    cursor.execute('PRAGMA table_info(products)') 
-    all_db_column_names = [col['name'] for col in cursor.fetchall()]
-
-    dynamic_columns_info_dict = {}
-    cursor.execute('SELECT column_name, column_type, options FROM stock_columns')
-    for row in cursor.fetchall():
-        options_list = []
-        db_options_str = row['options']
-        if db_options_str:
-            db_options_str = db_options_str.strip()
-            try:
-                loaded_options = json.loads(db_options_str)
-                if isinstance(loaded_options, list):
-                    options_list = loaded_options
-            except json.JSONDecodeError:
-                cleaned_str = db_options_str.replace('[', '').replace(']', '').strip()
-                options_list = [
-                    opt.strip().strip("'\"").replace('\\"', '"')
-                    for opt in cleaned_str.split(',') if opt.strip()
-                ]
-
-        dynamic_columns_info_dict[row['column_name']] = {
-            'column_type': row['column_type'],
-            'options': options_list
-        }
+    all_db_column_names, _ = _get_schema(db)
     
     columns_to_export = []
     fixed_columns = ['id', 'user_product_id', 'name', 'price'] 
@@ -693,32 +968,21 @@ def export_excel():
         flash('Excel\'e aktarılacak görünür sütun bulunamadı.', 'warning')
         return redirect(url_for('stok.stok_listesi'))
 
-    columns_str_for_query = ', '.join(columns_to_export)
-    
+    # Sütunlar yukarıda yalnızca PRAGMA table_info'dan gelen gerçek sütun adlarından seçilir; sorgu
+    # metni sütun kümesi başına bir kez, adlar tırnaklanarak (_build_export_sql) oluşturulur.
+
     try:
-        cursor.execute(f'SELECT {columns_str_for_query} FROM products') 
-        rows = cursor.fetchall() 
-
-        data_for_df = []
-        for row in rows:
-            row_dict = {}
-            for col_name in columns_to_export:
-                value = row[col_name]
-                
-                if col_name in ['id', 'user_product_id'] and value is not None:
-                     value = int(value) 
-                elif dynamic_columns_info_dict.get(col_name, {}).get('column_type') == 'number' and value is None:
-                    value = '' 
-
-                row_dict[col_name] = value
-            data_for_df.append(row_dict)
-
-        df = pd.DataFrame(data_for_df)
-
-        from io import BytesIO
+        # Satırlar sütun adıyla değil sırayla (columns_to_export sırası) yazılır; sqlite3.Row yerine
+        # düz tuple yeterlidir ve satır başına Row nesnesi oluşturulmaz.
+        cursor.row_factory = None
+        cursor.execute(_build_export_sql(tuple(columns_to_export)))
+
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='ÜrünVerileri') 
+        if request.args.get('styled') == '1' and openpyxl is not None:
+            _write_export_openpyxl(output, columns_to_export, cursor)
+        else:
+            _write_export_xlsxwriter(output, columns_to_export, cursor)
+
         output.seek(0)
         return send_file(output, as_attachment=True,
                         download_name='urun_verileri.xlsx', 
@@ -728,8 +992,153 @@ def export_excel():
         return redirect(url_for('stok.stok_listesi'))
 
 
+@stok_bp.route('/stok/import', methods=['POST'])
+@login_required
+def import_excel():
+    """
+    Excel dosyasındaki ürünleri toplu olarak 'products' tablosuna ekler.
+    Dosya, dışa aktarılan dosyayla aynı biçimdedir: 'name' ve 'price' sütunları zorunludur,
+    diğer sütunlardan yalnızca mevcut parametrelerle eşleşenler alınır; 'id' ve
+    'user_product_id' yok sayılır ve yeniden verilir. Satırlar add_product ile aynı kurallarla
+    doğrulanır; bir satır bile geçersizse hiçbir ürün eklenmez. Tüm ürünler ve varsayılan
+    envanter kayıtları executemany ile tek işlemde (tek commit) yazılır.
+    """
+    db = get_stock_db()
+    cursor = db.cursor()
+
+    excel_file = request.files.get('excel_file')
+    if not excel_file or not excel_file.filename:
+        flash('Lütfen içe aktarılacak bir Excel dosyası seçin.', 'danger')
+        return redirect(url_for('stok.stok_listesi'))
+
+    try:
+        df = pd.read_excel(excel_file, dtype=str).fillna('')
+    except Exception as e:
+        flash(f'Excel dosyası okunamadı: {e}', 'danger')
+        return redirect(url_for('stok.stok_listesi'))
+
+    if 'name' not in df.columns or 'price' not in df.columns:
+        flash('Excel dosyasında "name" ve "price" sütunları bulunmalıdır.', 'danger')
+        return redirect(url_for('stok.stok_listesi'))
+
+    validators = [v for v in _get_product_validators(db) if v[0] in df.columns]
+    insert_columns = ('user_product_id', 'name', 'price') + tuple(col_name for col_name, _, _, _ in validators)
+
+    rows = []
+    for row_number, record in enumerate(df.to_dict('records'), start=2): # 1. satır başlıklardır
+        name = record['name'].strip()
+        try:
+            if not name:
+                raise ValueError('Ürün adı boş bırakılamaz.')
+            try:
+                price = float(record['price'])
+            except ValueError:
+                raise ValueError('Fiyat geçerli bir sayı olmalıdır.')
+            values = [name, price]
+            for col_name, label, validate, options in validators:
+                values.append(validate(label, options, record[col_name].strip()))
+        except ValueError as e:
+            flash(f'{row_number}. satır: {e} Hiçbir ürün eklenmedi.', 'danger')
+            return redirect(url_for('stok.stok_listesi'))
+        rows.append(values)
+
+    if not rows:
+        flash('Excel dosyasında eklenecek ürün bulunamadı.', 'warning')
+        return redirect(url_for('stok.stok_listesi'))
+
+    try:
+        with db:
+            # Yazma kilidi baştan alınır; okunan MAX değerleri commit'e kadar değişmez
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(user_product_id), 0), COALESCE(MAX(id), 0) FROM products')
+            max_user_id, last_product_id = cursor.fetchone()
+            cursor.executemany(_insert_product_sql(insert_columns),
+                               ((max_user_id + i, *values) for i, values in enumerate(rows, start=1)))
+            # Yeni ürünlerin her biri için varsayılan envanter kaydı (konumsuz, 0 adet)
+            cursor.execute('''
+                INSERT INTO inventory (product_id, quantity, location)
+                SELECT id, 0, '' FROM products WHERE id > ?
+            ''', (last_product_id,))
+        flash(f'{len(rows)} ürün başarıyla içe aktarıldı.', 'success')
+    except Exception as e:
+        flash(f'Ürünler içe aktarılırken bir hata oluştu: {e}', 'danger')
+
+    return redirect(url_for('stok.stok_listesi'))
+
 # --- YENİ ENVANTER YÖNETİMİ BÖLÜMÜ ---
 
+# Envanterdeki konum listesi kullanıcı başına önbellekte tutulur: {user_id: (değişiklik sayacı, konumlar)}.
+# Kayıt, aynı okuma işleminde okunan stock_changes sayacıyla eşleştiği sürece kullanılır; hangi
+# worker'da olursa olsun envanterdeki her değişiklik sayacı artırdığından liste hiçbir zaman eskimez.
+_locations_cache = {}
+
+EXISTING_LOCATIONS_SQL = 'SELECT DISTINCT location FROM inventory WHERE location IS NOT NULL AND location != "" ORDER BY location'
+
+def _get_existing_locations(cursor, user_id, change_counter):
+    """
+    Envanterdeki boş olmayan, benzersiz konumları sıralı liste olarak döndürür (önbellekli).
+    `change_counter`, konum sorgusuyla aynı işlemde okunmuş stock_changes sayacıdır.
+    """
+    cached = _locations_cache.get(user_id)
+    if cached is not None and cached[0] == change_counter:
+        return cached[1]
+
+    cursor.execute(EXISTING_LOCATIONS_SQL)
+    existing_locations = [location for location, in cursor.fetchall()]
+    _locations_cache[user_id] = (change_counter, existing_locations)
+    return existing_locations
+
+# Envanter sayfasına giden satırlar; dict yerine daha küçük ve hızlı namedtuple'lar.
+# Şablon alanlara aynı adlarla erişir (entry.quantity, product.name ...).
+InvEntry = namedtuple('InvEntry', 'inventory_id quantity location last_updated')
+InvProduct = namedtuple('InvProduct', 'id user_product_id name price inventory_entries')
+EMPTY_INV_ENTRY = InvEntry(None, 0, '', 'N/A')
+
+@lru_cache(maxsize=None)
+def _envanter_sql(by_location, name_match):
+    """
+    Envanter sayfası sorgusunu döndürür; filtre birleşimi başına bir kez oluşturulur.
+    Aynı metin her istekte tekrar kullanıldığından bağlantının hazır ifade önbelleğinden gelir.
+    `name_match`: None (ad filtresi yok), 'fts' (trigram indeksi) veya 'like'.
+    """
+    # Ürünler ve envanter kayıtları tek sorguda (LEFT JOIN) çekilir; ürün başına ayrı sorgu yapılmaz.
+    # Konum filtresi varsa iç JOIN kullanılır: o konumda kaydı olmayan ürünler SQLite'tan hiç dönmez.
+    join_clause = 'LEFT JOIN inventory i ON i.product_id = p.id'
+    if by_location:
+        join_clause = 'JOIN inventory i ON i.product_id = p.id AND i.location = ?' # Konum için tam eşleşme
+
+    sql = f'''
+        SELECT 
+            p.id, p.user_product_id, p.name, p.price,
+            i.id AS inventory_id, 
+            i.quantity, 
+            i.location, 
+            i.last_updated 
+        FROM products p
+        {join_clause}
+    '''
+    if name_match == 'fts':
+        sql += ' WHERE p.id IN (SELECT rowid FROM products_fts WHERE name LIKE ?)'
+    elif name_match == 'like':
+        sql += ' WHERE p.name LIKE ?'
+
+    return sql + ' ORDER BY p.user_product_id, p.id, i.location'
+
+# Envanter sayfasının çıktısını belirleyen şablonlar; değiştiklerinde (ör. yeni sürüm) ETag da değişir
+ENVANTER_TEMPLATES = ('envanter.html', 'base.html')
+
+def _envanter_template_version():
+    """Envanter şablonlarının en son değiştirilme zamanını döndürür (ETag'in şablon sürümü)."""
+    env = current_app.jinja_env
+    return max(os.path.getmtime(env.get_template(name).filename) for name in ENVANTER_TEMPLATES)
+
+def _envanter_cache_headers(response, etag):
+    """Envanter yanıtına ETag ekler; tarayıcı her açılışta If-None-Match ile doğrulama yapar."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
 @stok_bp.route('/stok/envanter')
 @login_required
 def envanter_listesi():
@@ -739,86 +1148,121 @@ def envanter_listesi():
     Her ürün için birden fazla envanter kaydı gösterebilir.
     Ürün adı ve konum filtrelemesi eklendi.
     """
-    user_id = session.get('user_id')
-    db = get_stock_db()
+    user_id = g.user_id
+    db = get_stock_read_db() # Sayfa yalnızca okuma yapar
     cursor = db.cursor()
+    # Satırlar sırayla okunup doğrudan InvEntry/InvProduct'a dönüştürülür; ara sqlite3.Row nesnesine gerek yok
+    cursor.row_factory = None
 
     # Filtreleme parametrelerini al
     product_name_filter = request.args.get('product_name_filter', '').strip()
     location_filter = request.args.get('location_filter', '').strip()
 
-    # Ürünleri çeken ana sorguyu oluştur
-    # price sütununu da dahil et
-    product_query = 'SELECT id, user_product_id, name, price FROM products' 
-    product_query_params = []
-    
-    # Filtreleri SQL sorgusuna ekle
-    product_filters = []
-    if product_name_filter:
-        product_filters.append('name LIKE ?')
-        product_query_params.append(f'%{product_name_filter}%')
-    
-    if product_filters:
-        product_query += ' WHERE ' + ' AND '.join(product_filters)
-    
-    product_query += ' ORDER BY user_product_id'
-
-    cursor.execute(product_query, product_query_params)
-    products = cursor.fetchall()
-
-    # Her ürün için envanter kayıtlarını topla
-    product_inventory_data = []
-    for product in products:
-        product_dict = dict(product) # Row objesini dict'e çevir
-        
-        # Envanter kayıtları için ayrı bir sorgu ve filtreleme
-        inventory_query = '''
-            SELECT 
-                id AS inventory_id, 
-                quantity, 
-                location, 
-                last_updated 
-            FROM inventory 
-            WHERE product_id = ? 
-        '''
-        inventory_query_params = [product['id']]
-        
+    # Sayaç, konumlar ve ürün/envanter sorgusu tek okuma işleminde çalışır: hepsi aynı anlık görüntüyü
+    # görür (ETag ile sayfa içeriği tutarlı kalır) ve kilit her sorgu için ayrı ayrı alınmaz.
+    with db:
+        cursor.execute('BEGIN')
+
+        # Veri değişmediyse sayfa yeniden oluşturulmaz; ETag şablon sürümü, değişiklik sayacı ve filtrelerden türetilir
+        # (konum listesi de sayaca bağlıdır). Bekleyen flash mesajı varsa sayfa mesajı göstermek için
+        # her zaman oluşturulur.
+        change_counter = cursor.execute('SELECT counter FROM stock_changes WHERE id = 1').fetchone()[0]
+        etag = hashlib.blake2b(
+            f'{_envanter_template_version()}|{user_id}|{change_counter}|{product_name_filter}|{location_filter}'.encode(),
+            digest_size=16,
+        ).hexdigest()
+        use_etag = '_flashes' not in session
+        if use_etag and etag in request.if_none_match:
+            return _envanter_cache_headers(make_response('', 304), etag)
+
+        # Tüm benzersiz lokasyonlar (konum dropdown'ları için); sayaç değişmediyse önbellekten
+        existing_locations = _get_existing_locations(cursor, user_id, change_counter)
+
+        query_params = []
         if location_filter:
-            inventory_query += ' AND location = ?' # Konum için tam eşleşme
-            inventory_query_params.append(location_filter)
-        
-        inventory_query += ' ORDER BY location'
-
-        cursor.execute(inventory_query, inventory_query_params)
-        inventory_entries = cursor.fetchall()
-        
-        # Eğer envanter kaydı yoksa (veya filtreye uyan yoksa), varsayılan bir boş kayıt ekle (0 adet, boş konum)
-        # Ancak, eğer bir konum filtresi varsa ve bu ürünün bu konumda kaydı yoksa, bu ürünü listelemememiz gerekir.
-        # Bu durumda, eğer bu ürün için filtrelenmiş envanter kaydı gelmiyorsa, ana ürünü de atla.
-        if not inventory_entries and location_filter:
-            continue # Konum filtresi varsa ve bu ürün o konumda yoksa, ürünü tamamen atla.
-        
-        if not inventory_entries: # Eğer hiç kayıt yoksa ve konum filtresi yoksa, varsayılan boş kayıt ekle
-             inventory_entries = [{
-                'inventory_id': None, # Yeni kayıt olacağı için ID'si yok
-                'quantity': 0,
-                'location': '',
-                'last_updated': 'N/A'
-            }]
-        
-        product_dict['inventory_entries'] = [dict(entry) for entry in inventory_entries] # Nested dict listesi
-        product_inventory_data.append(product_dict)
-    
-    # Tüm benzersiz lokasyonları çek (konum dropdown'ları için)
-    cursor.execute('SELECT DISTINCT location FROM inventory WHERE location IS NOT NULL AND location != "" ORDER BY location')
-    existing_locations = [row['location'] for row in cursor.fetchall()]
-
-    return render_template('envanter.html', 
+            query_params.append(location_filter)
+        name_match = None
+        if product_name_filter:
+            # Trigram indeksi en az 3 karakterlik aramalarda LIKE'ı tablo taramadan karşılar
+            name_match = 'fts' if HAS_FTS_TRIGRAM and len(product_name_filter) >= 3 else 'like'
+            query_params.append(f'%{product_name_filter}%')
+
+        cursor.execute(_envanter_sql(bool(location_filter), name_match), query_params)
+
+        # Satırları ürüne göre grupla (sıralama p.id'yi de içerdiği için aynı ürünün satırları ardışıktır)
+        product_inventory_data = []
+        # Sütun sırası: 0 id, 1 user_product_id, 2 name, 3 price, 4.. envanter alanları (InvEntry sırası)
+        for product_id, rows in groupby(cursor.fetchall(), key=itemgetter(0)):
+            rows = list(rows)
+            first = rows[0]
+
+            if first[4] is None: # inventory_id (yalnızca LEFT JOIN'de, yani konum filtresi yokken)
+                # Hiç kayıt yoksa varsayılan boş kayıt ekle (0 adet, boş konum); ID'si yok, yeni kayıt olacak
+                inventory_entries = [EMPTY_INV_ENTRY]
+            else:
+                inventory_entries = [InvEntry(*row[4:]) for row in rows]
+
+            product_inventory_data.append(InvProduct(*first[:4], inventory_entries))
+
+    response = make_response(render_template('envanter.html', 
                            product_inventory_data=product_inventory_data, # Yeni değişken adı
                            existing_locations=existing_locations,
                            # Filtre değerlerini şablona geri gönder
                            product_name_filter=product_name_filter,
-                           location_filter=location_filter)
+                           location_filter=location_filter))
+    return _envanter_cache_headers(response, etag) if use_etag else response
+
+
+# last_updated zamanı Python'da biçimlendirilmez; SQLite yerel saatle (önceki datetime.now() ile
+# aynı 'YYYY-MM-DD HH:MM:SS' biçiminde) kendisi yazar.
+UPDATE_INVENTORY_SQL = '''
+    UPDATE inventory
+    SET quantity = ?, location = ?, last_updated = datetime('now', 'localtime')
+    WHERE id = ? AND product_id = ?
+'''
+
+# Yeni envanter kaydı ekler; ürünün bu konumda zaten kaydı varsa (UNIQUE(product_id, location))
+# INSERT OR REPLACE gibi satırı silip yeniden yazmak yerine mevcut satırı yerinde günceller.
+# Böylece kaydın id'si değişmez ve indeksler iki kez yazılmaz.
+UPSERT_INVENTORY_SQL = '''
+    INSERT INTO inventory (product_id, quantity, location, last_updated)
+    VALUES (?, ?, ?, datetime('now', 'localtime'))
+    ON CONFLICT(product_id, location) DO UPDATE SET
+        quantity = excluded.quantity,
+        last_updated = excluded.last_updated
+'''
+
+def _parse_inventory_entry(product_id, inventory_id, quantity_str, location):
+    """
+    update_inventory formundaki (veya toplu istekteki) bir envanter kaydını doğrular.
+    (product_id, inventory_id veya None, quantity, location) döndürür; geçersizse
+    kullanıcıya gösterilecek mesajla ValueError fırlatır.
+    """
+    if not product_id or quantity_str in (None, ''):
+        raise ValueError('Ürün ID ve adet bilgileri zorunludur.')
+    try:
+        product_id = int(product_id)
+        quantity = int(quantity_str)
+        # 'None': şablonda henüz envanter kaydı olmayan satırlar için gönderilen değer
+        inventory_id = int(inventory_id) if inventory_id not in (None, '', 'None') else None
+    except (TypeError, ValueError):
+        raise ValueError('Geçersiz ürün ID veya adet formatı.')
+    if quantity < 0:
+        raise ValueError('Adet negatif olamaz.')
+    # Form her zaman metin verir; JSON gövdesinde liste/sayı gibi değerler gelebilir
+    if location is not None and not isinstance(location, str):
+        raise ValueError('Geçersiz konum.')
+    return product_id, inventory_id, quantity, (location or '').strip()
+
+def _inventory_integrity_error(e, duplicate_message):
+    """
+    Envanter yazarken oluşan IntegrityError için JSON hata yanıtı döndürür.
+    foreign_keys=ON olduğundan olmayan bir ürüne kayıt eklemek de IntegrityError verir;
+    bu durum 404 ile, UNIQUE(product_id, location) ihlali `duplicate_message` ile 400 olarak bildirilir.
+    """
+    if 'FOREIGN KEY' in str(e):
+        return jsonify({'status': 'error', 'message': 'Ürün bulunamadı veya yetkiniz yok.'}), 404
+    return jsonify({'status': 'error', 'message': duplicate_message}), 400
 
 
 @stok_bp.route('/stok/update_inventory', methods=['POST'])
@@ -827,57 +1271,90 @@ def update_inventory():
     """
     Belirli bir ürünün belirli bir konumdaki envanter miktarını günceller.
     Eğer ürün için bu konumda envanter kaydı yoksa yeni bir kayıt oluşturur.
+    Birden fazla kayıt için update_inventory_batch kullanılır.
     """
     db = get_stock_db()
     cursor = db.cursor()
 
-    product_id = request.form.get('product_id')
-    inventory_id = request.form.get('inventory_id') # Mevcut bir kaydı güncelliyorsak
-    quantity_str = request.form.get('quantity')
-    location = request.form.get('location', '').strip() 
-
-    if not product_id or not quantity_str:
-        return jsonify({'status': 'error', 'message': 'Ürün ID ve adet bilgileri zorunludur.'}), 400
-
     try:
-        product_id = int(product_id)
-        quantity = int(quantity_str)
-        if quantity < 0:
-            return jsonify({'status': 'error', 'message': 'Adet negatif olamaz.'}), 400
-    except ValueError:
-        return jsonify({'status': 'error', 'message': 'Geçersiz ürün ID veya adet formatı.'}), 400
-
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        product_id, inventory_id, quantity, location = _parse_inventory_entry(
+            request.form.get('product_id'), request.form.get('inventory_id'),
+            request.form.get('quantity'), request.form.get('location', ''))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
     try:
-        if inventory_id and inventory_id != 'None': # Mevcut bir envanter kaydını güncelliyoruz
-            inventory_id = int(inventory_id)
-            cursor.execute('''
-                UPDATE inventory
-                SET quantity = ?, location = ?, last_updated = ?
-                WHERE id = ? AND product_id = ?
-            ''', (quantity, location, current_time, inventory_id, product_id))
+        if inventory_id is not None: # Mevcut bir envanter kaydını güncelliyoruz
+            cursor.execute(UPDATE_INVENTORY_SQL, (quantity, location, inventory_id, product_id))
             if cursor.rowcount == 0:
                 # Güncelleme başarısız olursa (ID/product_id eşleşmezse)
                 return jsonify({'status': 'error', 'message': 'Envanter kaydı bulunamadı veya yetkiniz yok.'}), 404
         else: # Yeni bir envanter kaydı ekliyoruz (product_id ve location kombinasyonu için)
-            # UNIQUE(product_id, location) constraint'i burada devreye girecek
-            cursor.execute('''
-                INSERT OR REPLACE INTO inventory (product_id, quantity, location, last_updated)
-                VALUES (?, ?, ?, ?)
-            ''', (product_id, quantity, location, current_time))
+            # Bu konumda zaten kayıt varsa (UNIQUE(product_id, location)) o kayıt güncellenir
+            cursor.execute(UPSERT_INVENTORY_SQL, (product_id, quantity, location))
         
         db.commit()
         return jsonify({'status': 'success', 'message': 'Envanter başarıyla güncellendi!'})
 
     except sqlite3.IntegrityError as e:
-        # Bu hata UNIQUE(product_id, location) ihlalinde oluşur
+        # UNIQUE(product_id, location) ihlali veya olmayan ürün (FOREIGN KEY)
         db.rollback()
-        return jsonify({'status': 'error', 'message': f'Bu ürün için aynı konumda zaten bir envanter kaydı mevcut. Lütfen mevcut kaydı güncelleyin veya farklı bir konum seçin.'}), 400
+        return _inventory_integrity_error(e, 'Bu ürün için aynı konumda zaten bir envanter kaydı mevcut. Lütfen mevcut kaydı güncelleyin veya farklı bir konum seçin.')
     except Exception as e:
         db.rollback() 
         return jsonify({'status': 'error', 'message': f'Envanter güncellenirken bir hata oluştu: {e}'}), 500
 
+@stok_bp.route('/stok/update_inventory_batch', methods=['POST'])
+@login_required
+def update_inventory_batch():
+    """
+    Birden fazla envanter kaydını tek istekte günceller/ekler.
+    İstek gövdesi JSON listesidir: [{product_id, inventory_id, quantity, location}, ...].
+    inventory_id'si olan kayıtlar güncellenir, olmayanlar eklenir (update_inventory ile aynı kurallar).
+    Tüm değişiklikler executemany ile tek işlemde yazılır (tek commit); bir kayıt bile
+    geçersizse veya bulunamazsa hiçbiri kaydedilmez.
+    """
+    db = get_stock_db()
+    cursor = db.cursor()
+
+    entries = request.get_json(silent=True)
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'status': 'error', 'message': 'Güncellenecek envanter kaydı gönderilmedi.'}), 400
+
+    update_rows = []
+    insert_rows = []
+    try:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise ValueError('Geçersiz envanter kaydı.')
+            product_id, inventory_id, quantity, location = _parse_inventory_entry(
+                entry.get('product_id'), entry.get('inventory_id'),
+                entry.get('quantity'), entry.get('location', ''))
+            if inventory_id is not None:
+                update_rows.append((quantity, location, inventory_id, product_id))
+            else:
+                insert_rows.append((product_id, quantity, location))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    try:
+        with db:
+            if update_rows:
+                cursor.executemany(UPDATE_INVENTORY_SQL, update_rows)
+                if cursor.rowcount != len(update_rows):
+                    # with bloğu hata ile çıkınca işlem geri alınır
+                    raise LookupError('Envanter kaydı bulunamadı veya yetkiniz yok.')
+            if insert_rows:
+                cursor.executemany(UPSERT_INVENTORY_SQL, insert_rows)
+        return jsonify({'status': 'success', 'message': f'{len(entries)} envanter kaydı başarıyla güncellendi!'})
+
+    except LookupError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except sqlite3.IntegrityError as e:
+        return _inventory_integrity_error(e, 'Aynı ürün için aynı konumda birden fazla envanter kaydı oluşacaktı. Lütfen konumları kontrol edin.')
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Envanter güncellenirken bir hata oluştu: {e}'}), 500
+
 @stok_bp.route('/stok/delete_inventory_entry/<int:inventory_id>', methods=['POST'])
 @login_required
 def delete_inventory_entry(inventory_id):